@@ -1,64 +1,164 @@
 """Proscenic Custom Component."""
-import asyncio
 import logging
+from time import monotonic
 
 from homeassistant import config_entries, core
-from homeassistant.const import CONF_USERNAME, CONF_DEVICES, CONF_PASSWORD, CONF_LOCATION
+from homeassistant.const import CONF_USERNAME, CONF_DEVICES, CONF_PASSWORD, CONF_LOCATION, CONF_API_TOKEN
+from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
+from homeassistant.helpers.storage import STORAGE_DIR
 
-from .const import DOMAIN, PROSCENICHOME
+from .const import DOMAIN, PROSCENICHOME, CONF_STATE_THROTTLE, DEFAULT_STATE_THROTTLE, CONF_RENDER_WORKERS, DEFAULT_RENDER_WORKERS, CONF_RENDER_PRIORITY, DEFAULT_RENDER_PRIORITY, RENDER_POOL, HISTORY_STORES
 from .proscenicapis import *
+from .history import CleanHistoryStore
+from .render_pool import RenderPool
+from .services import async_register_services
+from .websocket_api import async_register_websocket_commands
 
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORMS = ["vacuum", "camera", "sensor"]
+
 async def async_setup_entry(
     hass: core.HomeAssistant, config_entry: config_entries.ConfigEntry
 ) -> bool:
     """Set up platform from a ConfigEntry."""
+    setup_start = monotonic()
     hass.data.setdefault(DOMAIN, {})
+    async_register_websocket_commands(hass)
+    async_register_services(hass)
     hass_data = dict(config_entry.data)
     hass.data[DOMAIN][config_entry.entry_id] = hass_data
 
-    proscenic_home = ProscenicHome(config_entry.data[CONF_USERNAME], config_entry.data[CONF_PASSWORD], config_entry.data[CONF_LOCATION])
-    await proscenic_home.connect()
+    proscenic_home = ProscenicHome(
+        config_entry.data[CONF_USERNAME],
+        config_entry.data[CONF_PASSWORD],
+        config_entry.data[CONF_LOCATION],
+        config_entry.options.get(CONF_STATE_THROTTLE, DEFAULT_STATE_THROTTLE)
+    )
+    if CONF_DEVICES not in config_entry.data:
+        # Entries created before the config flow stored the devices log in once here
+        try:
+            await proscenic_home.get_token()
+            devices = await proscenic_home.get_devices()
+        except ValueError as ex:
+            raise ConfigEntryNotReady("Could not reach the Proscenic cloud") from ex
+        except (KeyError, TypeError) as ex:
+            raise ConfigEntryAuthFailed("Proscenic login failed") from ex
+        hass.config_entries.async_update_entry(
+            config_entry,
+            data={**config_entry.data, CONF_API_TOKEN: proscenic_home.token, CONF_DEVICES: devices}
+        )
+        proscenic_home.load_devices(devices)
+    else:
+        # Token and devices come from the config flow, sockets are looked up when first needed
+        proscenic_home.token = config_entry.data.get(CONF_API_TOKEN)
+        proscenic_home.load_devices(config_entry.data[CONF_DEVICES])
+        # Devices added or removed in the app since are picked up without delaying setup
+        config_entry.async_create_background_task(
+            hass,
+            async_refresh_devices(hass, config_entry, proscenic_home),
+            "proscenic_refresh_devices"
+        )
     hass.data[DOMAIN][config_entry.entry_id]['device'] = proscenic_home
+    hass.data[DOMAIN][config_entry.entry_id]['platforms'] = []
+    async_size_render_pool(hass)
+    hass.data[DOMAIN][config_entry.entry_id]['options'] = dict(config_entry.options)
+    config_entry.async_on_unload(config_entry.add_update_listener(options_update_listener))
+
+    @core.callback
+    def async_save_token(token):
+        if token != config_entry.data.get(CONF_API_TOKEN):
+            hass.config_entries.async_update_entry(
+                config_entry, data={**config_entry.data, CONF_API_TOKEN: token}
+            )
+
+    # Logins also happen on the vacuum socket threads
+    config_entry.async_on_unload(proscenic_home.subscribe_token(
+        lambda token: hass.loop.call_soon_threadsafe(async_save_token, token)
+    ))
 
     if 1 > len(proscenic_home.vacuums):
-        return False
+        _LOGGER.warning("No Proscenic vacuum found for %s", config_entry.data[CONF_USERNAME])
+        return True
+
+    history_stores = hass.data.setdefault(HISTORY_STORES, {})
+    for vacuum in proscenic_home.vacuums:
+        if vacuum.serial not in history_stores:
+            history_stores[vacuum.serial] = CleanHistoryStore(
+                hass.config.path(STORAGE_DIR, DOMAIN + '_history', vacuum.serial)
+            )
+        vacuum.history = history_stores[vacuum.serial]
+        vacuum.render_priority = config_entry.options.get(CONF_RENDER_PRIORITY, DEFAULT_RENDER_PRIORITY)
+
+    hass.data[DOMAIN][config_entry.entry_id]['platforms'] = PLATFORMS
+    await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    _LOGGER.debug("Proscenic entry setup finished after %.3f s", monotonic() - setup_start)
+    return True
 
-    hass.async_create_task(
-        hass.config_entries.async_forward_entry_setup(config_entry, "vacuum")
+
+@core.callback
+def async_size_render_pool(hass: core.HomeAssistant):
+    """Size the render pool shared by all entries to the largest render_workers of the loaded entries."""
+    render_workers = max(
+        (
+            entry.options.get(CONF_RENDER_WORKERS, DEFAULT_RENDER_WORKERS)
+            for entry in hass.config_entries.async_entries(DOMAIN)
+            if entry.entry_id in hass.data[DOMAIN]
+        ),
+        default=DEFAULT_RENDER_WORKERS
     )
-    hass.async_create_task(
-        hass.config_entries.async_forward_entry_setup(config_entry, "camera")
+    if RENDER_POOL not in hass.data:
+        hass.data[RENDER_POOL] = RenderPool(render_workers)
+    else:
+        hass.data[RENDER_POOL].set_workers(render_workers)
+
+
+async def async_refresh_devices(
+    hass: core.HomeAssistant, config_entry: config_entries.ConfigEntry, proscenic_home
+):
+    """Store the current device list and reload the entry if its vacuums changed."""
+    try:
+        devices = await proscenic_home.get_devices()
+    except (ValueError, KeyError, TypeError):
+        _LOGGER.debug("Could not refresh the Proscenic device list, keeping the stored one")
+        return
+    if devices == config_entry.data.get(CONF_DEVICES):
+        return
+    hass.config_entries.async_update_entry(
+        config_entry, data={**config_entry.data, CONF_DEVICES: devices}
     )
-    return True
+    known_serials = {vacuum.serial for vacuum in proscenic_home.vacuums}
+    serials = {device['sn'] for device in devices if device.get('typeName') == VACUUM_TYPE}
+    if serials != known_serials:
+        _LOGGER.info("Proscenic vacuums changed, reloading %s", config_entry.title)
+        # Reloading cancels this task, so it runs separately
+        hass.async_create_task(hass.config_entries.async_reload(config_entry.entry_id))
 
 
 async def options_update_listener(
     hass: core.HomeAssistant, config_entry: config_entries.ConfigEntry
 ):
-    """Handle options update."""
+    """Handle options update, token and device list updates need no reload."""
+    if dict(config_entry.options) == hass.data[DOMAIN][config_entry.entry_id]['options']:
+        return
     await hass.config_entries.async_reload(config_entry.entry_id)
 
 
 async def async_unload_entry(
     hass: core.HomeAssistant, config_entry: config_entries.ConfigEntry
 ) -> bool:
-    hass.data[DOMAIN][config_entry.entry_id]['device'].disconnect()
     """Unload a config entry."""
-    unload_ok = all(
-        await asyncio.gather(
-            *[hass.config_entries.async_forward_entry_unload(config_entry, "vacuum")]
-        )
-    )
-    unload_ok = all(
-        await asyncio.gather(
-            *[hass.config_entries.async_forward_entry_unload(config_entry, "camera")]
-        )
-    )
+    hass_data = hass.data[DOMAIN][config_entry.entry_id]
+    proscenic_home = hass_data['device']
+    proscenic_home.disconnect()
+    for vacuum in proscenic_home.vacuums:
+        # A socket push still in flight must not archive into the store of the next setup
+        vacuum.history = None
+    unload_ok = await hass.config_entries.async_unload_platforms(config_entry, hass_data['platforms'])
 
     # Remove config entry from domain.
     if unload_ok:
         hass.data[DOMAIN].pop(config_entry.entry_id)
+        async_size_render_pool(hass)
 
     return unload_ok
\ No newline at end of file
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 from datetime import timedelta
 import logging
 from typing import Any
 
 import async_timeout
+from aiohttp import web
 
 from homeassistant.components.camera import Camera, CameraEntityFeature
 from homeassistant.core import HomeAssistant, callback
@@ -12,12 +14,15 @@ from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.const import CONF_USERNAME, CONF_API_TOKEN, CONF_DEVICES, CONF_PASSWORD
 
-from .const import DOMAIN, PROSCENICHOME
+from .const import DOMAIN, PROSCENICHOME, RENDER_POOL, CONF_MAP_FORMAT, DEFAULT_MAP_FORMAT, MAP_FORMAT_SVG
 from .proscenicapis import *
 
 
 _LOGGER = logging.getLogger(__name__)
 
+STREAM_BOUNDARY = '--frameboundary'
+STREAM_KEEPALIVE = 60 # seconds
+
 async def async_setup_entry(
     hass: core.HomeAssistant,
     config_entry: config_entries.ConfigEntry,
@@ -25,26 +30,96 @@ async def async_setup_entry(
 ) -> None:
     """Setup sensors from a config entry created in the integrations UI."""
     config = hass.data[DOMAIN][config_entry.entry_id]
-    vacuum = [ProscenicMapCamera(config['device'])]
+    map_format = config_entry.options.get(CONF_MAP_FORMAT, DEFAULT_MAP_FORMAT)
+    vacuum = [ProscenicMapCamera(config['device'], map_format)]
     async_add_entities(vacuum, update_before_add=True)
 
 class ProscenicMapCamera(Camera):
     """Representation of a local file camera."""
     _attr_frame_interval = 5 # seconds
 
-    def __init__(self, proscenic_home):
+    def __init__(self, proscenic_home, map_format=DEFAULT_MAP_FORMAT):
         """Initialize Local File Camera component."""
         super().__init__()
 
         self.proscenic_home = proscenic_home
         self.vacuum = proscenic_home.vacuums[0]
-        self.content_type = 'image/png'
+        if map_format == MAP_FORMAT_SVG:
+            self.content_type = 'image/svg+xml'
+            self._render = self.vacuum.get_map_svg
+        else:
+            self.content_type = 'image/png'
+            self._render = self.vacuum.get_map
+
+        # One rendered frame per map change, shared by stills and every stream viewer
+        self._map_version = 0
+        self._frame = None
+        self._frame_version = None
+        self._frame_lock = asyncio.Lock()
+        self._viewers = set()
+
+    async def async_added_to_hass(self) -> None:
+        """Follow map and robot position changes now that hass is ready."""
+        self.async_on_remove(self.vacuum.subscribe_map(
+            lambda vacuum: self.hass.loop.call_soon_threadsafe(self._async_map_changed)
+        ))
+
+    @callback
+    def _async_map_changed(self):
+        self._map_version += 1
+        for viewer in self._viewers:
+            viewer.set()
+
+    async def _async_get_frame(self):
+        """Render the map at most once per change, whoever asks for it."""
+        async with self._frame_lock:
+            if self._frame is None or self._frame_version != self._map_version:
+                version = self._map_version
+                self._frame = await asyncio.wrap_future(
+                    self.hass.data[RENDER_POOL].submit(
+                        self.vacuum.serial, self._render, self.vacuum.render_priority
+                    )
+                )
+                self._frame_version = version
+            return self._frame
 
     async def async_camera_image(self, width = None, height = None):
         """Return image response."""
         
         await self.vacuum.get_paths()
-        return self.vacuum.get_map()
+        return await self._async_get_frame()
+
+    async def handle_async_mjpeg_stream(self, request):
+        """Push a new frame to the viewer only when the map or robot position changed."""
+        response = web.StreamResponse()
+        response.content_type = 'multipart/x-mixed-replace;boundary=' + STREAM_BOUNDARY
+        await response.prepare(request)
+
+        viewer = asyncio.Event()
+        viewer.set()
+        self._viewers.add(viewer)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(viewer.wait(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    pass
+                viewer.clear()
+                frame = await self._async_get_frame()
+                await response.write(
+                    bytes(
+                        STREAM_BOUNDARY + '\r\n'
+                        + 'Content-Type: ' + self.content_type + '\r\n'
+                        + 'Content-Length: ' + str(len(frame)) + '\r\n\r\n',
+                        'utf-8'
+                    )
+                    + frame
+                    + b'\r\n'
+                )
+        finally:
+            self._viewers.discard(viewer)
+
+        return response
 
     @property
     def name(self):
@@ -54,7 +129,7 @@ class ProscenicMapCamera(Camera):
     @property
     def extra_state_attributes(self):
         """Return the camera state attributes."""
-        return {}
+        return {'rooms': self.vacuum.rooms}
 
     @property
     def device_info(self):
@@ -12,7 +12,7 @@ from homeassistant.helpers.entity_registry import (
 )
 import voluptuous as vol
 
-from .const import DOMAIN
+from .const import DOMAIN, CONF_STATE_THROTTLE, DEFAULT_STATE_THROTTLE, CONF_RENDER_WORKERS, DEFAULT_RENDER_WORKERS, CONF_RENDER_PRIORITY, DEFAULT_RENDER_PRIORITY, CONF_MAP_FORMAT, DEFAULT_MAP_FORMAT, MAP_FORMAT_PNG, MAP_FORMAT_SVG
 from .proscenicapis import *
 
 _LOGGER = logging.getLogger(__name__)
@@ -31,16 +31,20 @@ class ProscenicConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     async def async_step_user(self, user_input: Optional[Dict[str, Any]] = None):
         errors: Dict[str, str] = {}
         if user_input is not None:
+            # One login in the chosen region, the entry setup reuses its token and device list
             try:
-                proscenic_home = ProscenicHome(user_input[CONF_USERNAME], user_input[CONF_PASSWORD])
-                await proscenic_home.connect()
-            except ValueError:
+                proscenic_home = ProscenicHome(user_input[CONF_USERNAME], user_input[CONF_PASSWORD], user_input[CONF_LOCATION])
+                await proscenic_home.get_token()
+                devices = await proscenic_home.get_devices()
+            except (ValueError, KeyError, TypeError):
                 errors["base"] = "auth"
             if not errors:
                 self.data = {}
                 self.data[CONF_USERNAME] = user_input[CONF_USERNAME]
                 self.data[CONF_PASSWORD] = user_input[CONF_PASSWORD]
                 self.data[CONF_LOCATION] = user_input[CONF_LOCATION]
+                self.data[CONF_API_TOKEN] = proscenic_home.token
+                self.data[CONF_DEVICES] = devices
                 return self.async_create_entry(title="Proscenic", data=self.data)
 
 
@@ -49,3 +53,68 @@ class ProscenicConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             step_id="user", data_schema=AUTH_SCHEMA, errors=errors
         )
 
+    async def async_step_reauth(self, entry_data: Dict[str, Any]):
+        """The stored login was rejected, ask for the password again."""
+        self.reauth_entry = self.hass.config_entries.async_get_entry(self.context["entry_id"])
+        return await self.async_step_reauth_confirm()
+
+    async def async_step_reauth_confirm(self, user_input: Optional[Dict[str, Any]] = None):
+        errors: Dict[str, str] = {}
+        if user_input is not None:
+            data = dict(self.reauth_entry.data)
+            try:
+                proscenic_home = ProscenicHome(data[CONF_USERNAME], user_input[CONF_PASSWORD], data[CONF_LOCATION])
+                await proscenic_home.get_token()
+                devices = await proscenic_home.get_devices()
+            except (ValueError, KeyError, TypeError):
+                errors["base"] = "auth"
+            if not errors:
+                data[CONF_PASSWORD] = user_input[CONF_PASSWORD]
+                data[CONF_API_TOKEN] = proscenic_home.token
+                data[CONF_DEVICES] = devices
+                self.hass.config_entries.async_update_entry(self.reauth_entry, data=data)
+                await self.hass.config_entries.async_reload(self.reauth_entry.entry_id)
+                return self.async_abort(reason="reauth_successful")
+
+        return self.async_show_form(
+            step_id="reauth_confirm",
+            data_schema=vol.Schema({vol.Required(CONF_PASSWORD): cv.string}),
+            errors=errors
+        )
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return ProscenicOptionsFlow(config_entry)
+
+
+class ProscenicOptionsFlow(config_entries.OptionsFlow):
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        self.config_entry = config_entry
+
+    async def async_step_init(self, user_input: Optional[Dict[str, Any]] = None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options_schema = vol.Schema(
+            {
+                vol.Required(
+                    CONF_STATE_THROTTLE,
+                    default=self.config_entry.options.get(CONF_STATE_THROTTLE, DEFAULT_STATE_THROTTLE),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0, max=60)),
+                vol.Required(
+                    CONF_RENDER_WORKERS,
+                    default=self.config_entry.options.get(CONF_RENDER_WORKERS, DEFAULT_RENDER_WORKERS),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=8)),
+                vol.Required(
+                    CONF_RENDER_PRIORITY,
+                    default=self.config_entry.options.get(CONF_RENDER_PRIORITY, DEFAULT_RENDER_PRIORITY),
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=9)),
+                vol.Required(
+                    CONF_MAP_FORMAT,
+                    default=self.config_entry.options.get(CONF_MAP_FORMAT, DEFAULT_MAP_FORMAT),
+                ): vol.In([MAP_FORMAT_PNG, MAP_FORMAT_SVG]),
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=options_schema)
+
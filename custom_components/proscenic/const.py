@@ -1,2 +1,18 @@
 DOMAIN = "proscenic"
-PROSCENICHOME = "proscenic_home"
\ No newline at end of file
+PROSCENICHOME = "proscenic_home"
+
+CONF_STATE_THROTTLE = "state_throttle"
+DEFAULT_STATE_THROTTLE = 2.0  # seconds
+
+CONF_RENDER_WORKERS = "render_workers"
+DEFAULT_RENDER_WORKERS = 1
+CONF_RENDER_PRIORITY = "render_priority"
+DEFAULT_RENDER_PRIORITY = 0
+RENDER_POOL = "proscenic_render_pool"
+# Clean history stores by vacuum serial, shared across reloads so one store owns each directory
+HISTORY_STORES = "proscenic_history_stores"
+
+CONF_MAP_FORMAT = "map_format"
+MAP_FORMAT_PNG = "png"
+MAP_FORMAT_SVG = "svg"
+DEFAULT_MAP_FORMAT = MAP_FORMAT_PNG
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""On-disk archive of finished cleaning runs."""
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+import zlib
+
+_LOGGER = logging.getLogger(__name__)
+
+# Number of runs kept per vacuum
+HISTORY_RETENTION = 50
+
+INDEX_FILE = 'index.json'
+
+
+class CleanHistoryStore:
+    """Archive of the runs of one vacuum.
+
+    Each run is a zlib compressed file of delta encoded path points. Maps are
+    stored once per distinct map and referenced by hash, and a small JSON
+    index holds the run summaries so listing runs never touches the paths.
+    """
+
+    def __init__(self, directory, retention=HISTORY_RETENTION):
+        self.directory = directory
+        self.retention = retention
+        self._lock = Lock()
+        self._index = None
+        self._writer = None
+
+    def runs(self):
+        """Return the run summaries, oldest first."""
+        with self._lock:
+            return list(self._load_index())
+
+    def get_run(self, run_id=None):
+        """Return the summary of run_id, or of the latest run if run_id is None."""
+        runs = self.runs()
+        if run_id is None:
+            return runs[-1] if runs else None
+        for run in runs:
+            if run['run_id'] == run_id:
+                return run
+        return None
+
+    def archive(self, path_positions, map_data, summary):
+        """Store a finished run, summary is extended with run_id, map_ref and points."""
+        if not path_positions:
+            return None
+        with self._lock:
+            index = self._load_index()
+            os.makedirs(self.directory, exist_ok=True)
+
+            map_ref = None
+            if map_data:
+                map_ref = hashlib.sha1(map_data['map'].encode('utf-8')).hexdigest()[:16]
+                map_file = os.path.join(self.directory, 'map_' + map_ref + '.json')
+                if not os.path.exists(map_file):
+                    self._write(map_file, json.dumps(map_data).encode('utf-8'))
+
+            run_id = (index[-1]['run_id'] + 1) if index else 1
+            self._write(
+                os.path.join(self.directory, 'run_' + str(run_id) + '.bin'),
+                self.encode_path(path_positions)
+            )
+            run = dict(summary)
+            run['run_id'] = run_id
+            run['map_ref'] = map_ref
+            run['points'] = len(path_positions)
+            index.append(run)
+
+            expired = index[:-self.retention] if len(index) > self.retention else []
+            del index[:len(expired)]
+            self._write(os.path.join(self.directory, INDEX_FILE), json.dumps(index).encode('utf-8'))
+            self._remove_expired(expired, index)
+            return run
+
+    def archive_later(self, path_positions, map_data, summary):
+        """Queue archive() on the writer thread of this store, runs are written in order."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='proscenic_history')
+        return self._writer.submit(self._archive_logged, path_positions, map_data, summary)
+
+    def _archive_logged(self, path_positions, map_data, summary):
+        try:
+            return self.archive(path_positions, map_data, summary)
+        except OSError as ex:
+            _LOGGER.warning("Could not archive run %s: %s", summary.get('path_id'), ex)
+            return None
+
+    def load_path(self, run_id):
+        with open(os.path.join(self.directory, 'run_' + str(run_id) + '.bin'), 'rb') as file:
+            return self.decode_path(file.read())
+
+    def load_map(self, map_ref):
+        if map_ref is None:
+            return None
+        with open(os.path.join(self.directory, 'map_' + map_ref + '.json'), 'rb') as file:
+            return json.loads(file.read())
+
+    @staticmethod
+    def encode_path(path_positions):
+        """Delta encode the points as 32 bit ints and compress them."""
+        deltas = array('i')
+        last_x, last_y = 0, 0
+        for position in path_positions:
+            x, y = round(position[0]), round(position[1])
+            deltas.append(x - last_x)
+            deltas.append(y - last_y)
+            last_x, last_y = x, y
+        return zlib.compress(deltas.tobytes(), 9)
+
+    @staticmethod
+    def decode_path(data):
+        deltas = array('i')
+        deltas.frombytes(zlib.decompress(data))
+        path_positions = []
+        x, y = 0, 0
+        for i in range(0, len(deltas), 2):
+            x += deltas[i]
+            y += deltas[i + 1]
+            path_positions.append([x, y])
+        return path_positions
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(os.path.join(self.directory, INDEX_FILE), 'rb') as file:
+                    self._index = json.loads(file.read())
+            except FileNotFoundError:
+                self._index = []
+            except ValueError:
+                _LOGGER.warning("Clean history index in %s is corrupt, starting over", self.directory)
+                self._index = []
+        return self._index
+
+    def _remove_expired(self, expired, index):
+        referenced_maps = {run['map_ref'] for run in index}
+        for run in expired:
+            files = ['run_' + str(run['run_id']) + '.bin']
+            if run['map_ref'] and run['map_ref'] not in referenced_maps:
+                files.append('map_' + run['map_ref'] + '.json')
+            for name in files:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _write(file_name, data):
+        # Write then rename so a crash never leaves a half written file behind
+        temp_name = file_name + '.tmp'
+        with open(temp_name, 'wb') as file:
+            file.write(data)
+        os.replace(temp_name, file_name)
@@ -1,22 +1,19 @@
-from time import sleep
+from time import sleep, monotonic, time
 import io
+import logging
 import aiohttp
 import asyncio
 
 import base64
 
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
-
 import json
 import hashlib
+import re
 
-from threading import Thread
-
-from PIL import Image, ImageDraw
-
-from ._block import decompress as lz4_decompress
+from threading import Lock, RLock, Thread
 
+# Pillow, pycryptodome and the native lz4 block decoder are imported where they
+# are used so that loading the integration does not pay for the map subsystem.
 #import lz4.block
 #lz4_decompress = lz4.block.decompress
 
@@ -27,12 +24,92 @@ VACUUM_TYPE = 'CleanRobot'
 
 EOL = '#\t#'
 
+_LOGGER = logging.getLogger(__name__)
+
+# Cloud endpoints that only read state, identical concurrent requests to them are sent once
+IDEMPOTENT_PATHS = ('/appInit/getSockAddr', '/app/cleanRobot/info', '/app/cleanRobot/21011/', '/user/getEquips/')
+READ_CACHE_TTL = 1.0  # seconds
+READ_CACHE_SIZE = 64
+
+# Requests per second allowed to each cloud host, and how many may be sent at once
+RATE_LIMIT = 5.0
+RATE_BURST = 10
+
+# Gray levels of the decoded map grid that identify rooms/segments
+ROOM_IDS = range(1, 10)
+
+# Display color of each gray level of the decoded map grid, other levels stay gray
+MAP_COLORS = {
+    127: (0, 0, 0, 0),
+    0: (15, 60, 152, 255),
+    255: (3, 98, 142, 255),
+    1: (5, 153, 99, 255),
+    2: (9, 153, 5, 255),
+    3: (141, 153, 5, 255),
+    4: (153, 103, 5, 255),
+    5: (153, 40, 5, 255),
+    6: (153, 5, 58, 255),
+    7: (151, 5, 153, 255),
+    8: (96, 5, 153, 255),
+    9: (40, 5, 153, 255),
+}
+
+# Largest map grid accepted from a 20002 frame
+MAX_MAP_PIXELS = 4096 * 4096
+
+# Fields of a 20002 frame that the decoded grid, rooms and renders depend on
+MAP_GRID_FIELDS = ('map', 'width', 'height', 'x_min', 'y_min', 'resolution')
+
+# Maximum number of 21011 pages pulled per get_paths call
+PATH_SYNC_MAX_PAGES = 10
+
+# Width in meters swept by the robot, used to rasterize cleaned area
+BRUSH_WIDTH = 0.3
+
+# Status keys that end up in the entity state, and the subset that is never throttled
+STATE_ATTRIBUTES = ('mode', 'elec', 'workNoisy', 'errorState')
+IMMEDIATE_STATE_ATTRIBUTES = ('mode', 'elec')
+
+
+class TokenBucket:
+    """Token bucket shared by every caller of one host, safe across threads and event loops."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+_HOST_BUCKETS = {}
+_HOST_BUCKETS_LOCK = Lock()
+
+
+def get_host_bucket(host_path):
+    with _HOST_BUCKETS_LOCK:
+        if host_path not in _HOST_BUCKETS:
+            _HOST_BUCKETS[host_path] = TokenBucket(RATE_LIMIT, RATE_BURST)
+        return _HOST_BUCKETS[host_path]
+
 
 class ProscenicHome:
-    def __init__(self, username, password, host_path=US_HOST_PATH):
+    def __init__(self, username, password, host_path=US_HOST_PATH, state_throttle=2.0):
         self.username = username
         self.password = password
         self.token = None
+        self.state_throttle = state_throttle
         if host_path == "US":
             host_path = US_HOST_PATH
         elif host_path == "EU":
@@ -45,6 +122,16 @@ class ProscenicHome:
         self.host_path = host_path
         self.url = 'https://' + self.host_path
         self.vacuums = []  # type: list[ProscenicHomeVacuum]
+        self.rate_limiter = get_host_bucket(self.host_path)
+        self._in_flight = {}
+        self._read_cache = {}
+        self._cache_lock = Lock()
+        self.token_listner = []
+
+    def subscribe_token(self, subscriber):
+        """Call subscriber with the new token after every login, returns an unsubscribe callable."""
+        self.token_listner.append(subscriber)
+        return lambda: self.token_listner.remove(subscriber)
 
     async def connect(self):
         if not self.token:
@@ -64,6 +151,12 @@ class ProscenicHome:
                         return
                     self.vacuums.append(vacuum)
 
+    def load_devices(self, devices):
+        """Create the vacuums of an already known device list without contacting the cloud."""
+        for device in devices:
+            if device.get('typeName') == VACUUM_TYPE:
+                self.vacuums.append(ProscenicHomeVacuum(self, device))
+
     def disconnect(self):
         for vacuum in self.vacuums:
             vacuum.disconnect()
@@ -105,10 +198,60 @@ class ProscenicHome:
 
         response = await self.send_post_command(url, data, headers)
         self.token = response['data']['token']
+        for listner in list(self.token_listner):
+            listner(self.token)
         return response['data']['token']
 
+    async def send_post_command(self, url, data, headers=None):
+        """Send a request to the cloud, sharing identical reads that are in flight or just answered."""
+        if not any(path in url for path in IDEMPOTENT_PATHS):
+            return await self._rate_limited_post(url, data, headers)
+
+        key = (url, self._request_key(data), self._request_key(headers))
+        # Vacuum sockets run their own event loops, a task can only be awaited on its own loop
+        loop = asyncio.get_running_loop()
+        # The caches are shared by the HA loop and every socket thread
+        with self._cache_lock:
+            cached = self._read_cache.get(key)
+            if cached and cached[0] > monotonic():
+                return cached[1]
+            task = self._in_flight.get((loop, key))
+            owner = task is None
+            if owner:
+                task = loop.create_task(self._rate_limited_post(url, data, headers))
+                self._in_flight[(loop, key)] = task
+        if not owner:
+            return await asyncio.shield(task)
+
+        try:
+            response = await asyncio.shield(task)
+        finally:
+            with self._cache_lock:
+                self._in_flight.pop((loop, key), None)
+
+        now = monotonic()
+        with self._cache_lock:
+            if len(self._read_cache) >= READ_CACHE_SIZE:
+                self._read_cache = {
+                    cache_key: entry for cache_key, entry in self._read_cache.items() if entry[0] > now
+                }
+            self._read_cache[key] = (now + READ_CACHE_TTL, response)
+        return response
+
     @staticmethod
-    async def send_post_command(url, data, headers=None):
+    def _request_key(value):
+        if isinstance(value, dict):
+            return json.dumps(value, sort_keys=True)
+        return value
+
+    async def _rate_limited_post(self, url, data, headers=None):
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await self.post(url, data, headers)
+
+    @staticmethod
+    async def post(url, data, headers=None):
         try:
             async with aiohttp.ClientSession() as session:
                 if headers:
@@ -143,6 +286,9 @@ class ProscenicHome:
 
     @staticmethod
     def decrypt(encrypted_message, token):
+        from Crypto.Cipher import AES
+        from Crypto.Util.Padding import unpad
+
         try:
             aes_key = token
             encrypted_message = encrypted_message
@@ -175,23 +321,110 @@ class ProscenicHomeVacuum:
         self.socket_prot = None
         self.socket_thread = None
         self.socket_loop = None
+        self.socket_task = None
         self.keep_alive = True
 
         self.map_data = None
+        self.map_version = 0
+        self.map_grid = None
+        # Room index of the current map, only read outside the socket thread
+        self.rooms = {}
+        self.brush_width = BRUSH_WIDTH
+        self.coverage = None
+        self.coverage_counts = {}
+        self.coverage_index = 0
+        # Map geometry the coverage bitmap was rasterized for
+        self.coverage_geometry = None
         self.path_data = None
         self.current_path_id = None
         self.path_position_array = []
+        # Pushed 21011 segments that arrived ahead of a gap, keyed by startPos
+        self.pending_path_segments = {}
+        self.path_synced = False
+        # Path and coverage state is changed from both the socket thread and the HA loop
+        self.path_lock = RLock()
+        # Archive of finished runs, a CleanHistoryStore set up by the integration
+        self.history = None
+        self.run_started = None
+        self.run_battery = None
+        # Time, battery and map when the current run stopped cleaning, archived with it
+        self.run_end = None
+        self.run_end_battery = None
+        self.run_end_map = None
         self.pil_map_image = None
         self.map_bytes = None
+        self.svg_layer = None
+        self.svg_layer_version = None
+        self.svg_path = None
+        self.svg_path_key = None
+        # Lower renders first when vacuums share the render pool, set from the entry options
+        self.render_priority = 0
         self.update_map = True
         self.update_robot_map = True
 
         self.listner = []
+        self.coverage_listner = []
+        self.map_listner = []
+        self.state_throttle = proscenic_home.state_throttle
+        self._notified_state = {}
+        self._last_notify = 0.0
+        self._pending_notify = None
     
     def subcribe(self, subscriber):
         self.listner.append(subscriber)
 
+    def subscribe_coverage(self, subscriber):
+        """Call subscriber when coverage or the room index changed, returns an unsubscribe callable."""
+        self.coverage_listner.append(subscriber)
+        return lambda: self.coverage_listner.remove(subscriber)
+
+    def subscribe_map(self, subscriber):
+        """Call subscriber whenever the rendered map would change, returns an unsubscribe callable."""
+        self.map_listner.append(subscriber)
+        return lambda: self.map_listner.remove(subscriber)
+
     def _call_listners(self):
+        """Coalesce status pushes into at most one listener call per throttle window."""
+        state = {key: self.status.get(key) for key in STATE_ATTRIBUTES}
+        if state == self._notified_state:
+            return
+        immediate = any(
+            state[key] != self._notified_state.get(key)
+            for key in IMMEDIATE_STATE_ATTRIBUTES
+        )
+        elapsed = monotonic() - self._last_notify
+        if immediate or elapsed >= self.state_throttle:
+            self._notify_listners(state)
+            return
+        if self._pending_notify is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._notify_listners(state)
+            return
+        self._pending_notify = loop.call_later(self.state_throttle - elapsed, self._flush_listners)
+
+    def _call_map_listners(self):
+        for listner in list(self.map_listner):
+            listner(self)
+
+    def _call_coverage_listners(self):
+        for listner in list(self.coverage_listner):
+            listner(self)
+
+    def _flush_listners(self):
+        self._pending_notify = None
+        state = {key: self.status.get(key) for key in STATE_ATTRIBUTES}
+        if state != self._notified_state:
+            self._notify_listners(state)
+
+    def _notify_listners(self, state):
+        if self._pending_notify is not None:
+            self._pending_notify.cancel()
+            self._pending_notify = None
+        self._notified_state = state
+        self._last_notify = monotonic()
         for listner in self.listner:
             listner(self)
 
@@ -199,9 +432,17 @@ class ProscenicHomeVacuum:
         did_connect = await self.update_sockets_ip()
         return did_connect
 
-    async def disconnect(self):
-        self.socket_loop.close()
+    def disconnect(self):
+        """Stop the socket thread, safe to call from any thread."""
         self.keep_alive = False
+        socket_loop = self.socket_loop
+        socket_task = self.socket_task
+        if socket_loop is not None and socket_task is not None and not socket_loop.is_closed():
+            try:
+                socket_loop.call_soon_threadsafe(socket_task.cancel)
+            except RuntimeError:
+                # The loop closed in the meantime, the thread is already done
+                pass
 
     async def update_sockets_ip(self):
         sockets = await self.get_socket_address()
@@ -220,38 +461,60 @@ class ProscenicHomeVacuum:
         self.socket_thread.start()
 
     def start_connect_socket(self, message_string, socket_ip, socket_port, socket_callback):
-        self.socket_loop = asyncio.new_event_loop()
-        task = self.connect_socket(message_string, socket_ip, socket_port, socket_callback)
-        self.socket_loop.run_until_complete(task)
+        socket_loop = asyncio.new_event_loop()
+        self.socket_task = socket_loop.create_task(
+            self.connect_socket(message_string, socket_ip, socket_port, socket_callback)
+        )
+        self.socket_loop = socket_loop
+        try:
+            socket_loop.run_until_complete(self.socket_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            socket_loop.close()
 
     async def connect_socket(self, message_string, socket_ip, socket_port, socket_callback):
+        # disconnect() may have run before this thread got its loop
+        if not self.keep_alive:
+            return
         reader, writer = await asyncio.open_connection(socket_ip, socket_port)
-        writer.write(message_string.encode())
-        await writer.drain()
-        reader._eof = False
-        while True:
-            try:
-                byte_data = await reader.readuntil(b'#\t#')
-                string = byte_data.decode('utf-8')
-                string = string.split(EOL)[0]
+        try:
+            writer.write(message_string.encode())
+            await writer.drain()
+            reader._eof = False
+            while self.keep_alive:
                 try:
-                    await socket_callback(string)
-                except ValueError:
-                    continue
-            except Exception as ex:
-                writer.close()
-                if not await self.connect():
-                    await self.proscenic_home.get_token()
-                    await self.update_sockets_ip()
-                    await asyncio.sleep(60)
-                reader, writer = await asyncio.open_connection(socket_ip, socket_port)
-                writer.write(message_string.encode())
-                await writer.drain()
+                    byte_data = await reader.readuntil(b'#\t#')
+                    string = byte_data.decode('utf-8')
+                    string = string.split(EOL)[0]
+                    try:
+                        await socket_callback(string)
+                    except ValueError:
+                        continue
+                except Exception as ex:
+                    writer.close()
+                    if not self.keep_alive:
+                        return
+                    # Pushes may be missed while reconnecting
+                    with self.path_lock:
+                        self.path_synced = False
+                    if not await self.connect():
+                        await self.proscenic_home.get_token()
+                        await self.update_sockets_ip()
+                        await asyncio.sleep(60)
+                    reader, writer = await asyncio.open_connection(socket_ip, socket_port)
+                    writer.write(message_string.encode())
+                    await writer.drain()
+        finally:
+            writer.close()
 
     async def update_state(self):
-        if not self.socket_ip:
-            await self.update_sockets_ip()
-        if self.socket_thread is not None and self.socket_thread.is_alive():
+        if not self.socket_ip and not await self.update_sockets_ip():
+            # A token stored before a restart may have expired
+            await self.proscenic_home.get_token()
+            if not await self.update_sockets_ip():
+                return
+        if not self.keep_alive or (self.socket_thread is not None and self.socket_thread.is_alive()):
             return
         infoType70001 = json.dumps({
             "data":
@@ -307,16 +570,57 @@ class ProscenicHomeVacuum:
             self.update_path_array_21011(decrypted_json)
 
     def update_status_20001(self, status_data):
+        moved = status_data['data'].get('pos') != self.status.get('pos')
+        stopped = self.status.get('mode') == 'sweep' and status_data['data'].get('mode') != 'sweep'
         self.status = status_data['data']
-        self.update_robot_map = True
+        if stopped:
+            with self.path_lock:
+                self.mark_run_end()
+        if moved:
+            self.update_robot_map = True
+            self._call_map_listners()
         self._call_listners()
 
     def update_map_20002(self, map_data):
-        self.map_data = map_data['data']
+        data_field = map_data['data']
+        width = data_field.get('width')
+        height = data_field.get('height')
+        # Reject malformed frames before they replace the current map
+        if (
+            not isinstance(width, int) or not isinstance(height, int)
+            or width < 1 or height < 1 or width * height > MAX_MAP_PIXELS
+            or not data_field.get('map')
+        ):
+            raise ValueError('Malformed map frame')
+        if self.map_data and all(self.map_data.get(field) == data_field.get(field) for field in MAP_GRID_FIELDS):
+            # The vacuum resends an unchanged map, keep the version so nothing is decoded or redrawn
+            self.map_data = data_field
+            return
+        if (
+            self.map_grid is not None and self.map_data['map'] == data_field['map']
+            and self.map_data['width'] == width and self.map_data['height'] == height
+        ):
+            # Only the origin or resolution moved, the grid decoded from this payload still holds
+            grid = self.map_grid
+        else:
+            # Decoding here rejects corrupt payloads before they replace the current map
+            grid = self.decode_map_grid(data_field)
+        self.map_data = data_field
+        self.map_version += 1
+        self.map_grid = grid
+        self.index_rooms()
         self.update_map = True
+        self._call_map_listners()
+        if self.coverage_listner:
+            self.update_coverage()
+            self._call_coverage_listners()
 
     def update_path_data_30000(self, path_data):
         self.path_data = path_data['data']
+        path_id = self.path_data.get('pathId')
+        with self.path_lock:
+            if path_id and path_id != self.current_path_id:
+                self.reset_path(path_id)
 
     def update_path_array_21011(self, path_data):
         data_field = path_data['data']
@@ -325,13 +629,115 @@ class ProscenicHomeVacuum:
         start_pos = data_field['startPos']
         if 1 > len(new_path_positions):
             return
-        if path_id != self.current_path_id:
+        with self.path_lock:
+            if path_id != self.current_path_id:
+                self.reset_path(path_id)
+            if self.merge_path_segment(start_pos, new_path_positions):
+                # Points pushed on the way back to the dock do not extend the run
+                if self.status.get('mode') == 'sweep' or self.run_end is None:
+                    self.mark_run_end()
+                self._path_changed()
+            if not self.pending_path_segments and start_pos <= len(self.path_position_array):
+                self.path_synced = True
+
+    def reset_path(self, path_id):
+        """Start a new run, the path of which has to be pulled before pushes can be trusted."""
+        with self.path_lock:
+            self.archive_run()
             self.path_position_array.clear()
+            self.pending_path_segments.clear()
             self.current_path_id = path_id
-        if len(self.path_position_array) > start_pos:
+            self.run_started = time()
+            self.run_battery = self.status.get('elec')
+            self.run_end = None
+            self.run_end_battery = None
+            self.run_end_map = None
+            self.coverage_geometry = None
+            self.path_synced = False
+            self._path_changed()
+
+    def mark_run_end(self):
+        """Remember the time, battery and map of the current run as it stands now."""
+        with self.path_lock:
+            self.run_end = time()
+            self.run_end_battery = self.status.get('elec')
+            self.run_end_map = self.map_data
+
+    def archive_run(self):
+        """Store the current run in the history before its path is dropped."""
+        if self.history is None or not self.path_position_array:
             return
-        self.path_position_array.extend(new_path_positions)
+        if self.run_end is None:
+            # Only pulled points are known, nothing better than now is available
+            self.mark_run_end()
+        end = self.run_end
+        map_data = self.run_end_map
+        area = None
+        if self.coverage is not None and map_data:
+            resolution: float = map_data['resolution']
+            area = round(self.coverage.histogram()[255] * resolution * resolution, 2)
+        battery_used = None
+        if self.run_battery is not None and self.run_end_battery is not None:
+            battery_used = self.run_battery - self.run_end_battery
+        summary = {
+            'path_id': self.current_path_id,
+            'start': self.run_started,
+            'end': end,
+            'duration': round(end - self.run_started) if self.run_started else None,
+            'area_m2': area,
+            'battery_used': battery_used,
+        }
+        # Compressing and writing happen on the history writer thread, not under path_lock
+        self.history.archive_later(list(self.path_position_array), map_data, summary)
+
+    def render_archived_run(self, run_id=None):
+        """Render a run from the history as PNG bytes, the latest if run_id is None."""
+        run = self.history.get_run(run_id) if self.history else None
+        if run is None:
+            raise ValueError('No archived run ' + str(run_id))
+        map_data = self.history.load_map(run['map_ref'])
+        if map_data is None:
+            raise ValueError('Run ' + str(run['run_id']) + ' has no map')
+        path_positions = self.history.load_path(run['run_id'])
+        image = self.draw_path(
+            self.color_map_grid(self.decode_map_grid(map_data)),
+            path_positions,
+            path_positions[-1],
+            map_data['x_min'],
+            map_data['y_min'],
+            map_data['resolution']
+        )
+        return self.map_image_to_bytes(image)
+
+    def merge_path_segment(self, start_pos, positions):
+        """Merge points starting at start_pos into the path, deduplicating by position index.
+
+        Segments beyond the end of the path are kept until the gap is filled.
+        Returns True if the path grew.
+        """
+        with self.path_lock:
+            if start_pos > len(self.path_position_array):
+                self.pending_path_segments[start_pos] = positions
+                self.path_synced = False
+                return False
+
+            path_count = len(self.path_position_array)
+            segments = [(start_pos, positions)]
+            while segments:
+                segment_start, segment = segments.pop()
+                overlap = len(self.path_position_array) - segment_start
+                if len(segment) > overlap:
+                    self.path_position_array.extend(segment[overlap:])
+                for pending_start in sorted(self.pending_path_segments):
+                    if pending_start <= len(self.path_position_array):
+                        segments.append((pending_start, self.pending_path_segments.pop(pending_start)))
+            return len(self.path_position_array) > path_count
+
+    def _path_changed(self):
         self.update_robot_map = True
+        self._call_map_listners()
+        if self.coverage_listner and self.update_coverage():
+            self._call_coverage_listners()
 
     def get_name(self):
         return self.name
@@ -486,28 +892,63 @@ class ProscenicHomeVacuum:
         return response
 
     async def get_paths(self):
+        """Pull the path points missing after a restart, reconnect or gap in the pushes.
+
+        Once the push stream is contiguous no request is made.
+        """
         await self.update_state()
         if self.map_data and not self.current_path_id:
             self.current_path_id = self.map_data['pathId']
 
-        if not self.current_path_id:
+        if not self.current_path_id or self.path_synced:
             return
 
-        current_index = str(len(self.path_position_array))
-        url = self.proscenic_home.url + '/app/cleanRobot/21011/' + self.serial + '/' + current_index
-        headers = {
-            'host': self.proscenic_home.host_path,
-            'token': self.proscenic_home.token,
-        }
-        data = {
-            'username': self.proscenic_home.username,
-            'pathId': self.current_path_id
-        }
+        path_id = self.current_path_id
+        response = None
+        loop = asyncio.get_running_loop()
+        for _ in range(PATH_SYNC_MAX_PAGES):
+            # Unlocked reads are only a hint for the page to ask for, merging deduplicates
+            had_pending = bool(self.pending_path_segments)
+            current_index = len(self.path_position_array)
+            url = self.proscenic_home.url + '/app/cleanRobot/21011/' + self.serial + '/' + str(current_index)
+            headers = {
+                'host': self.proscenic_home.host_path,
+                'token': self.proscenic_home.token,
+            }
+            data = {
+                'username': self.proscenic_home.username,
+                'pathId': path_id
+            }
 
-        response = await self.proscenic_home.send_post_command(url, data, headers)
+            response = await self.proscenic_home.send_post_command(url, data, headers)
+            data_field = response.get('data') if isinstance(response, dict) else None
+            if not isinstance(data_field, dict) or 'posArray' not in data_field:
+                break
+            # Merging takes path_lock and rasterizes coverage, neither belongs on the event loop
+            if not await loop.run_in_executor(
+                None, self.merge_pulled_page, path_id, current_index, had_pending, data_field
+            ):
+                break
         return response
 
+    def merge_pulled_page(self, path_id, current_index, had_pending, data_field):
+        """Merge a page pulled by get_paths, returns True if another page should be pulled."""
+        with self.path_lock:
+            # A push may have started a new run while the request was in flight
+            if path_id != self.current_path_id:
+                return False
+
+            grew = self.merge_path_segment(data_field.get('startPos', current_index), data_field['posArray'])
+            if grew:
+                self._path_changed()
+            # Caught up once the pull reached the pushed points, or there is nothing left to pull
+            if not self.pending_path_segments and (had_pending or not grew):
+                self.path_synced = True
+                return False
+            return grew
+
     def get_map(self):
+        from PIL import Image, ImageDraw
 
         if not self.map_data:
             if self.map_bytes:
@@ -530,63 +971,50 @@ class ProscenicHomeVacuum:
         return self.draw_map()
 
     def draw_map(self):
-
         if not self.update_map and not self.update_robot_map:
             return self.map_bytes
 
         if self.update_map:
-            map_string = self.map_data['map']
-            map_dimensions = (self.map_data['width'], self.map_data['height'])
+            self.pil_map_image = self.color_map_grid(self.get_map_grid())
+
+        image = self.draw_path(
+            self.pil_map_image,
+            self.path_position_array,
+            self.status.get('pos'),
+            self.map_data['x_min'],
+            self.map_data['y_min'],
+            self.map_data['resolution']
+        )
+        self.map_bytes = self.map_image_to_bytes(image)
+        self.update_map = False
+        self.update_robot_map = False
+        return self.map_bytes
 
-            clean_map_string = map_string.replace(" ", "+")
-            decoder = base64.b64decode
-            zipped_data = decoder(clean_map_string)
-            decompressed = lz4_decompress(zipped_data, (map_dimensions[0] * map_dimensions[1]))
-
-            self.pil_map_image = Image.frombytes("L", map_dimensions, decompressed)
-            self.pil_map_image = self.pil_map_image.convert("RGBA")
-            pixels = self.pil_map_image.load()
-            for y in range(self.pil_map_image.size[1]):
-                for x in range(self.pil_map_image.size[0]):
-                    if pixels[x, y] == (127, 127, 127, 255):
-                        pixels[x, y] = (0, 0, 0, 0)
-                    elif pixels[x, y] == (0, 0, 0, 255):
-                        pixels[x, y] = (15, 60, 152, 255)
-                    elif pixels[x, y] == (255, 255, 255, 255):
-                        pixels[x, y] = (3, 98, 142, 255)
-                    elif pixels[x, y] == (1, 1, 1, 255):
-                        pixels[x, y] = (5, 153, 99, 255)
-                    elif pixels[x, y] == (2, 2, 2, 255):
-                        pixels[x, y] = (9, 153, 5, 255)
-                    elif pixels[x, y] == (3, 3, 3, 255):
-                        pixels[x, y] = (141, 153, 5, 255)
-                    elif pixels[x, y] == (4, 4, 4, 255):
-                        pixels[x, y] = (153, 103, 5, 255)
-                    elif pixels[x, y] == (5, 5, 5, 255):
-                        pixels[x, y] = (153, 40, 5, 255)
-                    elif pixels[x, y] == (6, 6, 6, 255):
-                        pixels[x, y] = (153, 5, 58, 255)
-                    elif pixels[x, y] == (7, 7, 7, 255):
-                        pixels[x, y] = (151, 5, 153, 255)
-                    elif pixels[x, y] == (8, 8, 8, 255):
-                        pixels[x, y] = (96, 5, 153, 255)
-                    elif pixels[x, y] == (9, 9, 9, 255):
-                        pixels[x, y] = (40, 5, 153, 255)
-
-        image = self.pil_map_image.copy()
+    @staticmethod
+    def color_map_grid(grid):
+        """Return the decoded grid as an RGBA image colored by room."""
+        from PIL import Image
+
+        bands = [
+            grid.point([MAP_COLORS.get(value, (value, value, value, 255))[band] for value in range(256)])
+            for band in range(4)
+        ]
+        return Image.merge("RGBA", bands)
+
+    @classmethod
+    def draw_path(cls, map_image, path_positions, robot_pos, x_min: float, y_min: float, resolution: float):
+        """Return a copy of map_image with the path and robot drawn on it, flipped for display."""
+        from PIL import Image, ImageDraw
+
+        image = map_image.copy()
         draw_image = ImageDraw.Draw(image)
-        path_count = len(self.path_position_array)
-
-        robot_pos = self.status['pos']
-        x_min = self.map_data['x_min']
-        y_min = self.map_data['y_min']
-        resolution: float = self.map_data['resolution']
+        path_count = len(path_positions)
 
         if path_count > 0:
             shape = []
-            for index, path_point in list(enumerate(self.path_position_array)):
+            for index, path_point in list(enumerate(path_positions)):
 
-                this_point = self.vacuum_space_to_map_space(
+                this_point = cls.vacuum_space_to_map_space(
                     path_point,
                     x_min,
                     y_min,
@@ -596,23 +1024,266 @@ class ProscenicHomeVacuum:
                 shape.append((this_point[0], this_point[1]))
             draw_image.line(shape, fill="white", width=1, joint='curve')
 
-        map_robot_pos = self.vacuum_space_to_map_space(robot_pos, x_min, y_min, resolution)
-        draw_image.ellipse(
-            (
-                (map_robot_pos[0] - 4, map_robot_pos[1] - 4),
-                (map_robot_pos[0] + 4, map_robot_pos[1] + 4)
+        if robot_pos is not None:
+            map_robot_pos = cls.vacuum_space_to_map_space(robot_pos, x_min, y_min, resolution)
+            draw_image.ellipse(
+                (
+                    (map_robot_pos[0] - 4, map_robot_pos[1] - 4),
+                    (map_robot_pos[0] + 4, map_robot_pos[1] + 4)
+                )
+                ,
+                fill="black",
+                outline ="white"
+            )
+
+        return image.transpose(Image.FLIP_TOP_BOTTOM)
+
+    def get_map_svg(self):
+        """Return the map as SVG bytes, reusing the traced room layer until the map changes."""
+        if not self.map_data:
+            return b'<svg xmlns="http://www.w3.org/2000/svg" width="429" height="255"/>'
+
+        width, height = self.map_data['width'], self.map_data['height']
+        x_min = self.map_data['x_min']
+        y_min = self.map_data['y_min']
+        resolution: float = self.map_data['resolution']
+
+        if self.svg_layer_version != self.map_version:
+            self.svg_layer = self.trace_map_grid_svg(self.get_map_grid())
+            self.svg_layer_version = self.map_version
+
+        # Points of the path are formatted once, later updates only append the new ones
+        path_count = len(self.path_position_array)
+        key = (self.map_version, self.current_path_id)
+        if self.svg_path_key is None or self.svg_path_key[0] != key or self.svg_path_key[1] > path_count:
+            self.svg_path = []
+            self.svg_path_key = (key, 0)
+        for path_point in self.path_position_array[self.svg_path_key[1]:path_count]:
+            map_point = self.vacuum_space_to_map_space(path_point, x_min, y_min, resolution)
+            self.svg_path.append(str(map_point[0] + 0.5) + ',' + str(map_point[1] + 0.5))
+        self.svg_path_key = (key, path_count)
+
+        svg = [
+            '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 %d %d" width="%d" height="%d">' % (width, height, width, height),
+            # The grid is stored bottom up, like the PNG it is flipped for display
+            '<g transform="matrix(1 0 0 -1 0 %d)">' % height,
+            self.svg_layer,
+        ]
+        if self.svg_path:
+            svg.append(
+                '<polyline fill="none" stroke="white" stroke-width="1" stroke-linejoin="round" points="'
+                + ' '.join(self.svg_path) + '"/>'
             )
-            ,
-            fill="black",
-            outline ="white"
+        robot_pos = self.status.get('pos')
+        if robot_pos is not None:
+            map_robot_pos = self.vacuum_space_to_map_space(robot_pos, x_min, y_min, resolution)
+            svg.append(
+                '<circle cx="%s" cy="%s" r="4" fill="black" stroke="white"/>'
+                % (map_robot_pos[0] + 0.5, map_robot_pos[1] + 0.5)
+            )
+        svg.append('</g></svg>')
+        return ''.join(svg).encode('utf-8')
+
+    @staticmethod
+    def trace_map_grid_svg(grid):
+        """Trace the grid into one SVG path per gray level.
+
+        Each row is split into runs of equal value by a regex, and runs that repeat
+        on the following rows are merged into a single rectangle.
+        """
+        width, height = grid.size
+        data = grid.tobytes()
+        open_runs = {}  # (x0, x1, value) -> first row
+        shapes = {}  # value -> path commands
+        for y in range(height + 1):
+            runs = set()
+            if y < height:
+                row = data[y * width:(y + 1) * width]
+                for match in re.finditer(rb'(.)\1*', row, re.S):
+                    runs.add((match.start(), match.end(), row[match.start()]))
+            for run in [run for run in open_runs if run not in runs]:
+                y0 = open_runs.pop(run)
+                run_width = run[1] - run[0]
+                shapes.setdefault(run[2], []).append(
+                    'M%d %dh%dv%dh-%dz' % (run[0], y0, run_width, y - y0, run_width)
+                )
+            for run in runs:
+                if run not in open_runs:
+                    open_runs[run] = y
+
+        layer = []
+        for value, commands in sorted(shapes.items()):
+            color = MAP_COLORS.get(value, (value, value, value, 255))
+            if color[3] == 0:
+                continue
+            layer.append(
+                '<path shape-rendering="crispEdges" fill="rgb(%d,%d,%d)" d="%s"/>'
+                % (color[0], color[1], color[2], ''.join(commands))
+            )
+        return ''.join(layer)
+
+    def get_map_grid(self):
+        """Return the decoded map as an "L" image, decoded when its 20002 frame arrived."""
+        return self.map_grid
+
+    @staticmethod
+    def decode_map_grid(map_data):
+        """Decode the grid of a 20002 map, raising ValueError if it does not match its dimensions."""
+        from PIL import Image
+
+        from ._block import decompress as lz4_decompress
+
+        map_dimensions = (map_data['width'], map_data['height'])
+        map_size = map_dimensions[0] * map_dimensions[1]
+
+        try:
+            zipped_data = base64.b64decode(map_data['map'].replace(" ", "+"))
+            decompressed = lz4_decompress(zipped_data, map_size)
+        except Exception:
+            raise ValueError('Map does not decode to ' + str(map_size) + ' bytes')
+        if len(decompressed) != map_size:
+            raise ValueError('Map decompressed to ' + str(len(decompressed)) + ' bytes, expected ' + str(map_size))
+
+        # The image shares the decompressed buffer instead of copying it
+        return Image.frombuffer("L", map_dimensions, decompressed, "raw", "L", 0, 1)
+
+    def index_rooms(self):
+        """Rebuild self.rooms from the current map, called on the socket thread when a map arrives.
+
+        Rooms are keyed by segment id and hold the bounding box, centroid and
+        area in map pixels plus the area in m² and the centroid in vacuum space.
+        """
+        from PIL import Image
+
+        grid = self.get_map_grid()
+        if grid is None:
+            return
+
+        resolution: float = self.map_data['resolution']
+        histogram = grid.histogram()
+        rooms = {}
+        for room_id in ROOM_IDS:
+            area = histogram[room_id]
+            if area == 0:
+                continue
+            lut = [1 if value == room_id else 0 for value in range(256)]
+            mask = grid.point(lut)
+            bbox = mask.getbbox()
+            x0, y0, x1, y1 = bbox
+            # Row and column projections of the mask, averaged in C by a box resize
+            crop = mask.crop(bbox).convert("F")
+            columns = crop.resize((x1 - x0, 1), Image.BOX).getdata()
+            rows = crop.resize((1, y1 - y0), Image.BOX).getdata()
+            centroid_x = x0 + sum(x * count for x, count in enumerate(columns)) * (y1 - y0) / area
+            centroid_y = y0 + sum(y * count for y, count in enumerate(rows)) * (x1 - x0) / area
+            rooms[room_id] = {
+                'bbox': bbox,
+                'area': area,
+                'area_m2': round(area * resolution * resolution, 2),
+                'centroid': (round(centroid_x, 1), round(centroid_y, 1)),
+                'position': self.map_space_to_vacuum_space(
+                    (centroid_x, centroid_y),
+                    self.map_data['x_min'],
+                    self.map_data['y_min'],
+                    resolution
+                ),
+            }
+
+        self.rooms = rooms
+
+    def update_coverage(self):
+        """Rasterize path points not yet in the coverage bitmap.
+
+        Only the bounding box of the new segment is touched, and the per-room
+        covered pixel counts are updated from the pixels it newly covers.
+        Returns True if the bitmap changed.
+        """
+        with self.path_lock:
+            return self._rasterize_coverage()
+
+    def _rasterize_coverage(self):
+        from PIL import Image, ImageChops, ImageDraw
+
+        grid = self.get_map_grid()
+        if grid is None:
+            return False
+        # Map pushes during a run keep the bitmap, only a new geometry starts it over
+        geometry = (
+            self.map_data['width'],
+            self.map_data['height'],
+            self.map_data['x_min'],
+            self.map_data['y_min'],
+            self.map_data['resolution']
         )
+        if self.coverage_geometry != geometry:
+            self.coverage = Image.new("L", grid.size)
+            self.coverage_counts = {}
+            self.coverage_index = 0
+            self.coverage_geometry = geometry
 
-        image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        image.show()
-        self.map_bytes = self.map_image_to_bytes(image)
-        self.update_map = False
-        self.update_robot_map = False
-        return self.map_bytes
+        path_count = len(self.path_position_array)
+        if path_count <= self.coverage_index:
+            return False
+        # Start from the last rasterized point so consecutive segments join up
+        start = max(self.coverage_index - 1, 0)
+        x_min = self.map_data['x_min']
+        y_min = self.map_data['y_min']
+        resolution: float = self.map_data['resolution']
+        points = [
+            self.vacuum_space_to_map_space(path_point, x_min, y_min, resolution)
+            for path_point in self.path_position_array[start:path_count]
+        ]
+        self.coverage_index = path_count
+
+        brush = max(round(self.brush_width / resolution), 1)
+        radius = brush // 2 + 1
+        box = (
+            max(min(point[0] for point in points) - radius, 0),
+            max(min(point[1] for point in points) - radius, 0),
+            min(max(point[0] for point in points) + radius + 1, grid.size[0]),
+            min(max(point[1] for point in points) + radius + 1, grid.size[1])
+        )
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return False
+
+        segment = Image.new("L", (box[2] - box[0], box[3] - box[1]))
+        draw_segment = ImageDraw.Draw(segment)
+        shape = [(point[0] - box[0], point[1] - box[1]) for point in points]
+        if len(shape) > 1:
+            draw_segment.line(shape, fill=255, width=brush, joint='curve')
+        for point in (shape[0], shape[-1]):
+            draw_segment.ellipse(
+                (
+                    (point[0] - brush / 2, point[1] - brush / 2),
+                    (point[0] + brush / 2, point[1] + brush / 2)
+                ),
+                fill=255
+            )
+
+        newly_covered = ImageChops.subtract(segment, self.coverage.crop(box))
+        if not newly_covered.getbbox():
+            return False
+        histogram = Image.composite(grid.crop(box), Image.new("L", segment.size), newly_covered).histogram()
+        for room_id in ROOM_IDS:
+            self.coverage_counts[room_id] = self.coverage_counts.get(room_id, 0) + histogram[room_id]
+        self.coverage.paste(255, box, newly_covered)
+        return True
+
+    def get_room_coverage(self):
+        """Return the covered share of each room in percent for the current run."""
+        rooms = self.rooms
+        return {
+            room_id: round(100.0 * self.coverage_counts.get(room_id, 0) / room['area'], 1)
+            for room_id, room in rooms.items()
+        }
+
+    @staticmethod
+    def map_space_to_vacuum_space(position, x_min: float, y_min: float, resolution: float):
+        local_resolution = resolution * 1000.0
+        return [
+            round(position[0] * local_resolution + x_min * 1000.0),
+            round(position[1] * local_resolution + y_min * 1000.0)
+        ]
 
     @staticmethod
     def vacuum_space_to_map_space(position, x_min: float, y_min: float, resolution: float):
@@ -0,0 +1,97 @@
+"""Bounded map render pool shared by every vacuum of every config entry."""
+from concurrent.futures import Future
+import heapq
+from itertools import count
+import logging
+from threading import Condition, Thread
+from time import monotonic
+
+_LOGGER = logging.getLogger(__name__)
+
+# Priority levels a queued job gains per second it waits, so busy vacuums cannot starve the rest
+RENDER_AGING = 1.0
+
+
+class RenderPool:
+    """Run map decode/render jobs on a fixed number of worker threads.
+
+    Each vacuum has at most one queued job. Submitting again before it started
+    replaces the queued job and the earlier callers get the newer result, so a
+    burst of pushes from one vacuum never queues more than one render. Queued
+    jobs run by priority (lower first) minus RENDER_AGING per second waited,
+    then in submission order, and jobs of one vacuum never run concurrently.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(workers, 1)
+        self._condition = Condition()
+        self._queue = []  # heap of (aged priority, sequence, key)
+        self._jobs = {}  # key -> [func, future]
+        self._running = set()
+        self._sequence = count()
+        self._threads = 0
+        self._busy = 0
+
+    def set_workers(self, workers):
+        """Change the number of worker threads, surplus workers exit once idle."""
+        with self._condition:
+            self.workers = max(workers, 1)
+            self._start_workers()
+
+    def submit(self, key, func, priority=0) -> Future:
+        """Queue func for key, superseding a job for the same key that has not started yet."""
+        with self._condition:
+            if key in self._jobs:
+                job = self._jobs[key]
+                job[0] = func
+                return job[1]
+            future = Future()
+            self._jobs[key] = [func, future]
+            # Every queued job ages at the same rate, so priority - RENDER_AGING * (now - submitted)
+            # orders the same as this key, which never has to change while the job waits
+            heapq.heappush(self._queue, (priority + RENDER_AGING * monotonic(), next(self._sequence), key))
+            self._start_workers()
+            return future
+
+    def _start_workers(self):
+        # Threads that are rendering do not count, only idle ones can take queued jobs
+        while self._threads < self.workers and self._threads - self._busy < len(self._queue):
+            self._threads += 1
+            Thread(target=self._work, name='proscenic_render', daemon=True).start()
+
+    def _next_job(self):
+        # Jobs whose vacuum is rendering elsewhere are left for that worker to pick up
+        busy = []
+        job = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[2] in self._running:
+                busy.append(entry)
+                continue
+            job = entry[2]
+            break
+        for entry in busy:
+            heapq.heappush(self._queue, entry)
+        return job
+
+    def _work(self):
+        key = None
+        while True:
+            with self._condition:
+                if key is not None:
+                    self._running.discard(key)
+                    self._busy -= 1
+                key = self._next_job() if self._threads <= self.workers else None
+                if key is None:
+                    self._threads -= 1
+                    return
+                self._running.add(key)
+                self._busy += 1
+                func, future = self._jobs.pop(key)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func())
+            except Exception as ex:
+                _LOGGER.exception("Map render failed")
+                future.set_exception(ex)
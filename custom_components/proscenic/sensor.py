@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import logging
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import PERCENTAGE
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN, PROSCENICHOME
+from .proscenicapis import *
+
+_LOGGER = logging.getLogger(__name__)
+
+async def async_setup_entry(
+    hass: core.HomeAssistant,
+    config_entry: config_entries.ConfigEntry,
+    async_add_entities,
+) -> None:
+    """Setup sensors from a config entry created in the integrations UI."""
+    config = hass.data[DOMAIN][config_entry.entry_id]
+    vacuum = config['device'].vacuums[0]
+    known_rooms = set()
+
+    def add_new_rooms(vacuum):
+        """Rooms only become known once a map arrives, so sensors are added as they show up."""
+        sensors = [
+            ProscenicRoomCoverageSensor(vacuum, room_id)
+            for room_id in vacuum.rooms
+            if room_id not in known_rooms
+        ]
+        if not sensors:
+            return
+        known_rooms.update(sensor.room_id for sensor in sensors)
+        hass.add_job(async_add_entities, sensors)
+
+    add_new_rooms(vacuum)
+    config_entry.async_on_unload(vacuum.subscribe_coverage(add_new_rooms))
+
+class ProscenicRoomCoverageSensor(SensorEntity):
+    """Share of a room covered during the current cleaning run."""
+    _attr_should_poll = False
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_icon = 'mdi:texture-box'
+
+    def __init__(self, vacuum, room_id) -> None:
+        self.vacuum = vacuum
+        self.room_id = room_id
+        self._attr_name = self.vacuum.get_name() + ' room ' + str(room_id) + ' coverage'
+
+    async def async_added_to_hass(self) -> None:
+        """Follow coverage updates once hass is ready."""
+        self.async_on_remove(
+            self.vacuum.subscribe_coverage(lambda vacuum: self.schedule_update_ha_state())
+        )
+
+    @property
+    def native_value(self) -> float | None:
+        """Return the covered percentage of the room."""
+        return self.vacuum.get_room_coverage().get(self.room_id)
+
+    @property
+    def device_info(self):
+        """Return the device info."""
+        return {"identifiers": {(DOMAIN, self.vacuum.uid)}}
+
+    @property
+    def unique_id(self) -> str:
+        """Return an unique ID."""
+        return "coverage" + self.vacuum.uid + "_" + str(self.room_id)
@@ -0,0 +1,60 @@
+"""Services of the Proscenic integration."""
+from __future__ import annotations
+
+import logging
+
+from homeassistant.core import HomeAssistant, ServiceCall, callback
+from homeassistant.exceptions import HomeAssistantError
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+SERVICE_RENDER_RUN = "render_run"
+
+RENDER_RUN_SCHEMA = vol.Schema(
+    {
+        vol.Required("serial"): cv.string,
+        vol.Optional("run_id"): vol.Coerce(int),
+        vol.Required("filename"): cv.string,
+    }
+)
+
+
+def find_vacuum(hass: HomeAssistant, serial: str):
+    """Return the vacuum with the serial number across all config entries."""
+    for entry_data in hass.data.get(DOMAIN, {}).values():
+        for vacuum in entry_data['device'].vacuums:
+            if vacuum.serial == serial:
+                return vacuum
+    return None
+
+
+@callback
+def async_register_services(hass: HomeAssistant) -> None:
+    """Register the integration services once."""
+    if hass.services.has_service(DOMAIN, SERVICE_RENDER_RUN):
+        return
+
+    async def async_render_run(call: ServiceCall) -> None:
+        """Render an archived run to a PNG file, loading it from disk only for this call."""
+        vacuum = find_vacuum(hass, call.data["serial"])
+        if vacuum is None:
+            raise HomeAssistantError("Unknown vacuum " + call.data["serial"])
+        filename = call.data["filename"]
+        if not hass.config.is_allowed_path(filename):
+            raise HomeAssistantError("Cannot write " + filename + ", no access to path")
+
+        def render():
+            image = vacuum.render_archived_run(call.data.get("run_id"))
+            with open(filename, 'wb') as file:
+                file.write(image)
+
+        try:
+            await hass.async_add_executor_job(render)
+        except (ValueError, OSError) as ex:
+            raise HomeAssistantError(str(ex)) from ex
+
+    hass.services.async_register(DOMAIN, SERVICE_RENDER_RUN, async_render_run, schema=RENDER_RUN_SCHEMA)
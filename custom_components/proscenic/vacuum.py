@@ -9,6 +9,7 @@ import async_timeout
 
 from homeassistant.components.vacuum import StateVacuumEntity, VacuumEntityFeature, STATE_CLEANING, STATE_DOCKED, STATE_IDLE, STATE_PAUSED, STATE_RETURNING
 from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.icon import icon_for_battery_level
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
@@ -26,7 +27,7 @@ async def async_setup_entry(
     """Setup sensors from a config entry created in the integrations UI."""
     config = hass.data[DOMAIN][config_entry.entry_id]
     vacuum = [ProscenicVacuum(config['device'])]
-    async_add_entities(vacuum, update_before_add=True)
+    async_add_entities(vacuum)
 
 class ProscenicVacuum(StateVacuumEntity):
     """Ecovacs Vacuums such as Deebot."""
@@ -55,11 +56,15 @@ class ProscenicVacuum(StateVacuumEntity):
 
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
-        return
+        # The socket lookup (and a login if the stored token expired) must not hold up entry setup
+        self.platform.config_entry.async_create_background_task(
+            self.hass, self.async_update_ha_state(True), "proscenic_vacuum_connect"
+        )
 
     async def async_update(self) -> None:
         if not await self.vacuum.connect():
-            await self.proscenic_home.connect()
+            await self.proscenic_home.get_token()
+            await self.vacuum.connect()
         await self.vacuum.update_state()
         if not self.vacuum.status:
             return
@@ -152,7 +157,16 @@ class ProscenicVacuum(StateVacuumEntity):
     ) -> None:
         """Send a command to a vacuum cleaner."""
         if command == 'app_segment_clean':
-            duplicates_removed = list(dict.fromkeys(params))
+            duplicates_removed = list(dict.fromkeys(params or []))
+            try:
+                segment_ids = [int(e) for e in duplicates_removed]
+            except (TypeError, ValueError):
+                raise HomeAssistantError('Segment ids must be numbers, got ' + str(params))
+            # Rooms are unknown until the first map arrived, then only its segments are accepted
+            rooms = self.vacuum.rooms
+            unknown = [segment_id for segment_id in segment_ids if rooms and segment_id not in rooms]
+            if unknown:
+                raise HomeAssistantError('Unknown segment ids ' + ', '.join(str(e) for e in unknown))
             string_list = ','.join(str(e) for e in duplicates_removed)
             await self.vacuum.clean_segment(string_list)
             self.vacuum.status['mode'] = 'sweep'
@@ -0,0 +1,86 @@
+"""Websocket API streaming map and path deltas to vector map frontends."""
+from __future__ import annotations
+
+import logging
+
+from homeassistant.components import websocket_api
+from homeassistant.core import HomeAssistant, callback
+import voluptuous as vol
+
+from .services import find_vacuum
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@callback
+def async_register_websocket_commands(hass: HomeAssistant) -> None:
+    """Register the websocket commands of the integration."""
+    websocket_api.async_register_command(hass, ws_subscribe_map)
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): "proscenic/map/subscribe",
+        vol.Required("serial"): str,
+    }
+)
+@callback
+def ws_subscribe_map(hass: HomeAssistant, connection, msg) -> None:
+    """Send the map grid once per map version, then only new path points and the robot pose.
+
+    Messages are events of one of these types:
+    - map: the grid as the vendor sends it, base64 encoded LZ4 block of width*height gray levels
+    - path: points from index start onwards, reset is set when a new run started
+    - pose: the current robot position in vacuum space
+    """
+    vacuum = find_vacuum(hass, msg["serial"])
+    if vacuum is None:
+        connection.send_error(msg["id"], websocket_api.const.ERR_NOT_FOUND, "Unknown vacuum")
+        return
+
+    sent = {'map_version': None, 'path_id': None, 'path_count': 0, 'pos': None}
+
+    @callback
+    def send_changes():
+        if vacuum.map_data and sent['map_version'] != vacuum.map_version:
+            sent['map_version'] = vacuum.map_version
+            connection.send_event_message(msg["id"], {
+                'type': 'map',
+                'version': vacuum.map_version,
+                'encoding': 'lz4+base64',
+                'map': vacuum.map_data['map'].replace(" ", "+"),
+                'width': vacuum.map_data['width'],
+                'height': vacuum.map_data['height'],
+                'x_min': vacuum.map_data['x_min'],
+                'y_min': vacuum.map_data['y_min'],
+                'resolution': vacuum.map_data['resolution'],
+            })
+
+        # Only the points the client has not seen are copied, the path grows on the socket thread
+        path_positions = vacuum.path_position_array
+        path_count = len(path_positions)
+        reset = sent['path_id'] != vacuum.current_path_id or path_count < sent['path_count']
+        if reset:
+            sent['path_id'] = vacuum.current_path_id
+            sent['path_count'] = 0
+        if reset or path_count > sent['path_count']:
+            connection.send_event_message(msg["id"], {
+                'type': 'path',
+                'path_id': vacuum.current_path_id,
+                'reset': reset,
+                'start': sent['path_count'],
+                'points': path_positions[sent['path_count']:path_count],
+            })
+            sent['path_count'] = path_count
+
+        pos = vacuum.status.get('pos')
+        if pos is not None and pos != sent['pos']:
+            sent['pos'] = pos
+            connection.send_event_message(msg["id"], {'type': 'pose', 'pos': pos})
+
+    # Vacuum pushes arrive on the socket thread
+    connection.subscriptions[msg["id"]] = vacuum.subscribe_map(
+        lambda vacuum: hass.loop.call_soon_threadsafe(send_changes)
+    )
+    connection.send_result(msg["id"])
+    send_changes()
@@ -0,0 +1,160 @@
+"""Compare the startup cost of the Proscenic integration before and after lazy setup.
+
+Two things are measured, each in a fresh interpreter so module caches are cold:
+
+import  Importing proscenicapis. "before" adds the imports the module used to
+        make at load time (Pillow, pycryptodome and the bundled lz4 decoder,
+        which is skipped where its musl build cannot load), "after" is the
+        module as it is now.
+
+setup   The cloud requests async_setup_entry waits for, against a local fake
+        cloud that answers every request after --latency ms. "before" is
+        ProscenicHome.connect() (login, getEquips and getSockAddr per vacuum),
+        which the old setup awaited. "after" builds the vacuums from the device
+        list stored by the config flow. The socket lookup now happens after
+        setup, when the vacuum entity has been added.
+
+Home Assistant itself is not needed, so the forwarding of the platforms is not
+part of either figure.
+
+    python scripts/benchmark_startup.py [--runs N] [--latency MS] [--vacuums N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+from threading import Thread
+
+from aiohttp import web
+
+COMPONENT = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'proscenic')
+)
+
+# Runs in a child interpreter: argv is component, mode, fake cloud url, vacuum count
+CHILD = '''
+import asyncio, importlib, importlib.util, json, sys, types
+from time import perf_counter
+
+component, mode, cloud_url, vacuum_count = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+package = types.ModuleType('proscenic')
+package.__path__ = [component]
+sys.modules['proscenic'] = package
+
+start = perf_counter()
+spec = importlib.util.spec_from_file_location('proscenic.proscenicapis', component + '/proscenicapis.py')
+api = importlib.util.module_from_spec(spec)
+sys.modules['proscenic.proscenicapis'] = api
+spec.loader.exec_module(api)
+block_loaded = None
+if mode == 'before':
+    import PIL.Image, PIL.ImageDraw, Crypto.Cipher.AES, Crypto.Util.Padding
+    try:
+        importlib.import_module('proscenic._block')
+        block_loaded = True
+    except ImportError:
+        block_loaded = False
+import_time = perf_counter() - start
+pil_loaded = 'PIL' in sys.modules
+
+devices = [
+    {'typeName': api.VACUUM_TYPE, 'sn': 'SN%d' % i, 'name': 'Vacuum %d' % i}
+    for i in range(vacuum_count)
+]
+
+async def setup():
+    home = api.ProscenicHome('user@example.com', 'password', 'EU')
+    home.url = cloud_url
+    if mode == 'before':
+        await home.connect()
+    else:
+        home.token = 'token'
+        home.load_devices(devices)
+    return len(home.vacuums)
+
+start = perf_counter()
+vacuums = asyncio.run(setup())
+setup_time = perf_counter() - start
+
+print(json.dumps({
+    'import': import_time,
+    'setup': setup_time,
+    'vacuums': vacuums,
+    'pil_loaded': pil_loaded,
+    'block_loaded': block_loaded,
+}))
+'''
+
+
+def start_fake_cloud(latency, vacuum_count):
+    """Serve the login, device list and socket lookup endpoints on a local port."""
+    devices = [
+        {'typeName': 'CleanRobot', 'sn': 'SN%d' % i, 'name': 'Vacuum %d' % i}
+        for i in range(vacuum_count)
+    ]
+
+    async def reply(data):
+        await asyncio.sleep(latency)
+        return web.json_response({'code': 0, 'data': data})
+
+    async def login(request):
+        return await reply({'token': '0123456789abcdef'})
+
+    async def get_equips(request):
+        return await reply({'content': devices})
+
+    async def get_sock_addr(request):
+        return await reply({'addr_list': [{'ip': '127.0.0.1', 'port': 1}]})
+
+    app = web.Application()
+    app.router.add_post('/user/login', login)
+    app.router.add_post('/user/getEquips/{username}', get_equips)
+    app.router.add_post('/appInit/getSockAddr', get_sock_addr)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    Thread(target=loop.run_forever, daemon=True).start()
+    return 'http://127.0.0.1:' + str(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=100, help='fake cloud latency per request in ms')
+    parser.add_argument('--vacuums', type=int, default=1)
+    args = parser.parse_args()
+
+    cloud_url = start_fake_cloud(args.latency / 1000, args.vacuums)
+    results = {'before': [], 'after': []}
+    for _ in range(args.runs):
+        # Interleaved so drift on the machine affects both sides alike
+        for mode in results:
+            output = subprocess.run(
+                [sys.executable, '-c', CHILD, COMPONENT, mode, cloud_url, str(args.vacuums)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results[mode].append(json.loads(output))
+
+    print('%d runs, %d vacuum(s), fake cloud latency %.0f ms' % (args.runs, args.vacuums, args.latency))
+    for key in ('import', 'setup'):
+        for mode in results:
+            times = sorted(result[key] * 1000 for result in results[mode])
+            print('%-6s %-6s median %8.2f ms  min %8.2f ms  max %8.2f ms' % (
+                key, mode, statistics.median(times), times[0], times[-1]
+            ))
+    print('Pillow loaded by import: before %s, after %s' % (
+        results['before'][0]['pil_loaded'], results['after'][0]['pil_loaded']
+    ))
+    if not results['before'][0]['block_loaded']:
+        print('The bundled lz4 decoder does not load on this host, "import before" leaves it out')
+
+
+if __name__ == '__main__':
+    main()